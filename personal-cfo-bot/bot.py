@@ -5,25 +5,38 @@
 """
 
 import os
+import re
+import socket
+import atexit
 import logging
 import asyncio
 import threading
-from typing import Dict
+from dataclasses import dataclass
+from datetime import timedelta
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from copy import copy
+from typing import Any, Dict, NamedTuple, Optional
+import orjson
 from dotenv import load_dotenv
 
 from aiogram import Bot, Dispatcher, F
 from aiogram.enums import ParseMode
-from aiogram.filters import Command
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest, TelegramForbiddenError
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StateType, StorageKey
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.types import (
     Message, 
     ReplyKeyboardMarkup, 
     KeyboardButton
 )
 from aiogram.utils.keyboard import ReplyKeyboardBuilder
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 
 # Импорт для веб-сервера
 from aiohttp import web
@@ -44,35 +57,166 @@ if not API_TOKEN:
     print("=" * 60)
     exit(1)
 
-# Настройка логирования
+# Формат токена от @BotFather: <id бота>:<35 символов>
+_TOKEN_RE = re.compile(r"\d{6,12}:[A-Za-z0-9_-]{35}")
+
+if not _TOKEN_RE.fullmatch(API_TOKEN):
+    print("=" * 60)
+    print("❌ ОШИБКА: TELEGRAM_BOT_TOKEN имеет неверный формат!")
+    print("=" * 60)
+    print("Ожидается токен вида 123456789:AAE... от @BotFather")
+    print("Проверьте, что токен скопирован целиком, без кавычек и пробелов")
+    print("=" * 60)
+    exit(1)
+
+# Публичный адрес сервиса для вебхука (Render сам выставляет RENDER_EXTERNAL_URL).
+# Если адрес не задан, бот работает через long polling — удобно для локального запуска.
+# Пустой WEBHOOK_URL явно включает polling даже на Render.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", os.getenv("RENDER_EXTERNAL_URL", "")).rstrip("/")
+# Секрет вебхука: входит в путь и проверяется в заголовке X-Telegram-Bot-Api-Secret-Token.
+# Задается только явно: случайный секрет в каждом процессе ломал бы запуск нескольких
+# процессов и перерегистрировал вебхук при каждом рестарте.
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+
+if WEBHOOK_URL and not WEBHOOK_SECRET:
+    print("=" * 60)
+    print("❌ ОШИБКА: WEBHOOK_SECRET не задан для режима вебхука!")
+    print("=" * 60)
+    print(f"Бот получает обновления через вебхук на {WEBHOOK_URL}")
+    print("Добавьте переменную окружения WEBHOOK_SECRET, например:")
+    print('python -c "import secrets; print(secrets.token_urlsafe(32))"')
+    print("Для запуска через long polling задайте пустой WEBHOOK_URL")
+    print("=" * 60)
+    exit(1)
+
+WEBHOOK_PATH = f"/webhook/{WEBHOOK_SECRET}"
+
+# Redis для хранения состояний: переживает рестарты и позволяет запускать несколько реплик
+REDIS_URL = os.getenv("REDIS_URL")
+
+# Служебный чат, куда при запуске отправляются статичные сообщения; дальше они
+# пересылаются пользователям через copyMessage без повторной отправки текста.
+# CACHE_WELCOME_MSG_ID и CACHE_EXAMPLE_MSG_ID позволяют переиспользовать уже
+# отправленные сообщения, а не публиковать новые при каждом запуске.
+CACHE_ENV = ("CACHE_CHAT_ID", "CACHE_WELCOME_MSG_ID", "CACHE_EXAMPLE_MSG_ID")
+
+for name in CACHE_ENV:
+    if os.getenv(name) and not re.fullmatch(r"-?\d+", os.getenv(name)):
+        print("=" * 60)
+        print(f"❌ ОШИБКА: {name} должен быть целым числом!")
+        print("=" * 60)
+        print(f"Сейчас задано: {os.getenv(name)!r}")
+        print("Пример: CACHE_CHAT_ID=-1001234567890")
+        print("=" * 60)
+        exit(1)
+
+CACHE_CHAT_ID = int(os.getenv("CACHE_CHAT_ID")) if os.getenv("CACHE_CHAT_ID") else None
+
+# Настройка логирования: запись в поток идет в фоновом потоке,
+# чтобы вызовы logger.* не блокировали цикл событий
+log_queue = SimpleQueue()
+log_listener = QueueListener(log_queue, logging.StreamHandler(), respect_handler_level=True)
+log_listener.start()
+atexit.register(log_listener.stop)
+
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    handlers=[QueueHandler(log_queue)]
 )
 logger = logging.getLogger(__name__)
 
+class CompactMemoryStorage(MemoryStorage):
+    """
+    MemoryStorage, который не держит пустые записи: после state.clear()
+    запись пользователя удаляется, и память не растет с числом пользователей
+    """
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await super().set_state(key, state)
+        self._drop_if_empty(key)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        record = self.storage.get(key)
+        return record.state if record else None
+
+    async def set_data(self, key: StorageKey, data: Dict) -> None:
+        await super().set_data(key, data)
+        self._drop_if_empty(key)
+
+    async def get_data(self, key: StorageKey) -> Dict:
+        record = self.storage.get(key)
+        return record.data.copy() if record else {}
+
+    async def get_value(self, storage_key: StorageKey, dict_key: str, default: Any = None) -> Any:
+        record = self.storage.get(storage_key)
+        return copy(record.data.get(dict_key, default)) if record else default
+
+    def _drop_if_empty(self, key: StorageKey) -> None:
+        record = self.storage.get(key)
+        if record is not None and record.state is None and not record.data:
+            del self.storage[key]
+
+class KeepAliveAiohttpSession(AiohttpSession):
+    """AiohttpSession с более долгим keep-alive и очисткой оборванных TLS-соединений"""
+
+    def __init__(self, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        # Публичного способа передать параметры TCPConnector в aiogram нет, поэтому
+        # дополняем приватный _connector_init; ttl_dns_cache=3600 из aiogram не трогаем
+        self._connector_init.update(keepalive_timeout=75, enable_cleanup_closed=True)
+
+# HTTP-сессия к Telegram API: быстрый orjson и пул постоянных соединений
+session = KeepAliveAiohttpSession(
+    json_loads=orjson.loads,
+    json_dumps=lambda value: orjson.dumps(value).decode(),
+)
+
 # Инициализация бота (исправлено для aiogram 3.7.0+)
 bot = Bot(
     token=API_TOKEN,
-    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+    session=session,
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML, link_preview_is_disabled=True)
 )
-storage = MemoryStorage()
+if REDIS_URL:
+    from aiogram.fsm.storage.redis import RedisStorage, DefaultKeyBuilder
+    # Брошенные расчеты удаляются самим Redis по TTL
+    storage = RedisStorage.from_url(
+        REDIS_URL,
+        key_builder=DefaultKeyBuilder(with_bot_id=True, with_destiny=True),
+        state_ttl=timedelta(hours=1),
+        data_ttl=timedelta(hours=1),
+        json_loads=orjson.loads,
+        json_dumps=orjson.dumps,
+    )
+else:
+    storage = CompactMemoryStorage()
 dp = Dispatcher(storage=storage)
 
 # ================== ВЕБ-СЕРВЕР ДЛЯ RENDER ==================
+# Тело ответа health check кодируется один раз
+HEALTH_BODY = "✅ Личный CFO Bot is running!".encode("utf-8")
+
 async def health_check(request):
     """Простой health-check endpoint для Render"""
-    return web.Response(text="✅ Личный CFO Bot is running!")
+    return web.Response(body=HEALTH_BODY, content_type="text/plain", charset="utf-8")
 
 async def start_web_server():
-    """Запуск веб-сервера на порту 8080"""
+    """Запуск веб-сервера на порту 8080 (health check и, при наличии адреса, вебхук)"""
     app = web.Application()
     app.router.add_get('/', health_check)
     app.router.add_get('/health', health_check)
     
-    runner = web.AppRunner(app)
+    if WEBHOOK_URL:
+        # Telegram присылает обновления сам — на тот же сервер, что и health check
+        SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+        setup_application(app, dp, bot=bot)
+    
+    # Без access log: пробы health check приходят постоянно и только засоряют логи
+    runner = web.AppRunner(app, access_log=None)
     await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', 8080)
+    # SO_REUSEPORT позволяет нескольким процессам слушать один порт (ядро распределит соединения).
+    # Имеет смысл только в режиме вебхука: при long polling Telegram отдает обновления одному процессу.
+    site = web.TCPSite(runner, '0.0.0.0', 8080, reuse_port=hasattr(socket, "SO_REUSEPORT"))
     await site.start()
     logger.info("🌐 Health check сервер запущен на порту 8080")
 
@@ -88,50 +232,58 @@ class BudgetStates(StatesGroup):
     waiting_for_goal_amount = State()
     waiting_for_goal_months = State()
 
-# Хранилище данных пользователя (временное, в памяти)
-user_data: Dict[int, Dict] = {}
+@dataclass(slots=True)
+class Budget:
+    """Данные, введенные пользователем для расчета"""
+    salary: int = 0
+    other_income: int = 0
+    rent: int = 0
+    transport: int = 0
+    other_bills: int = 0
+    goal_name: str = "финансовую цель"
+    goal_amount: int = 0
+    goal_months: int = 1
+
+@dataclass(slots=True)
+class Results:
+    """Результаты расчета бюджета"""
+    total_income: int
+    fixed_expenses: int
+    monthly_contribution: int
+    monthly_budget: int
+    daily_limit: int
 
 # ================== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==================
+# Символы-разделители, которые удаляются из введенного числа
+# (включая неразрывный и узкий пробелы, которые вставляет Telegram)
+_STRIP_NUM = str.maketrans("", "", " ,\u00a0\u202f")
+# Дневной лимит считается из расчета на 30 дней в месяце
+DAYS_IN_MONTH = 30
+# Больше 12 цифр — заведомо ошибка ввода; заодно суммы не выходят за int64,
+# который умеет сериализовать orjson в RedisStorage
+MAX_DIGITS = 12
+
+def parse_int(text: str) -> Optional[int]:
+    """Разбирает неотрицательное целое из ввода пользователя, None — если это не число"""
+    digits = text.translate(_STRIP_NUM)
+    return int(digits) if digits.isdecimal() and len(digits) <= MAX_DIGITS else None
+
 def format_rubles(amount: int) -> str:
     """Форматирует число в рубли с пробелами-разделителями"""
-    if amount == 0:
-        return "0 ₽"
     return f"{amount:,} ₽".replace(",", " ")
 
-def calculate_results(data: Dict) -> Dict:
+def calculate_results(budget: Budget) -> Results:
     """
     Выполняет все финансовые расчеты на основе введенных данных
     """
-    # Доходы
-    salary = int(data.get('salary', 0))
-    other_income = int(data.get('other_income', 0))
-    total_income = salary + other_income
-    
-    # Расходы
-    rent = int(data.get('rent', 0))
-    transport = int(data.get('transport', 0))
-    other_bills = int(data.get('other_bills', 0))
-    fixed_expenses = rent + transport + other_bills
-    
-    # Цель
-    goal_amount = int(data.get('goal_amount', 0))
-    goal_months = max(1, int(data.get('goal_months', 1)))
-    monthly_contribution = (goal_amount + goal_months - 1) // goal_months
-    
-    # Бюджет
+    total_income = budget.salary + budget.other_income
+    fixed_expenses = budget.rent + budget.transport + budget.other_bills
+    # Взнос на цель округляется вверх, чтобы накопить сумму точно в срок
+    monthly_contribution = -(-budget.goal_amount // max(1, budget.goal_months))
     monthly_budget = total_income - fixed_expenses - monthly_contribution
-    days_in_month = 30
-    daily_limit = monthly_budget // days_in_month if monthly_budget > 0 else 0
+    daily_limit = monthly_budget // DAYS_IN_MONTH if monthly_budget > 0 else 0
     
-    return {
-        'total_income': total_income,
-        'fixed_expenses': fixed_expenses,
-        'monthly_contribution': monthly_contribution,
-        'monthly_budget': monthly_budget,
-        'daily_limit': daily_limit,
-        'goal_name': data.get('goal_name', 'финансовую цель'),
-        'goal_months': goal_months
-    }
+    return Results(total_income, fixed_expenses, monthly_contribution, monthly_budget, daily_limit)
 
 # ================== КЛАВИАТУРЫ ==================
 def get_main_keyboard() -> ReplyKeyboardMarkup:
@@ -159,13 +311,14 @@ def get_skip_keyboard() -> ReplyKeyboardMarkup:
     builder.adjust(2)
     return builder.as_markup(resize_keyboard=True)
 
-# ================== ОБРАБОТЧИКИ КОМАНД ==================
-@dp.message(Command("start", "help"))
-async def cmd_start(message: Message):
-    """
-    Обработчик команд /start и /help
-    """
-    welcome_text = """
+# Клавиатуры не меняются, поэтому строим их один раз и переиспользуем
+MAIN_KB = get_main_keyboard()
+CANCEL_KB = get_cancel_keyboard()
+SKIP_KB = get_skip_keyboard()
+
+# ================== ТЕКСТЫ ==================
+# Статичные сообщения собираются один раз при импорте модуля
+WELCOME_TEXT = """
 👋 <b>Добро пожаловать в Личный CFO!</b>
 
 Я помогу рассчитать ваш <b>дневной бюджетный лимит</b> — сумму, которую можно тратить каждый день после всех обязательных платежей и отчислений на цель.
@@ -181,18 +334,9 @@ async def cmd_start(message: Message):
 • <b>❓ Помощь</b> — показать это сообщение
 
 <b>💡 Просто нажмите «💰 Рассчитать бюджет» чтобы начать!</b>
-    """
-    await message.answer(welcome_text, reply_markup=get_main_keyboard())
+""".strip()
 
-@dp.message(F.text == "❓ Помощь")
-async def cmd_help(message: Message):
-    """Показать справку"""
-    await cmd_start(message)
-
-@dp.message(F.text == "📊 Пример расчета")
-async def show_example(message: Message):
-    """Показать пример расчета"""
-    example_text = """
+EXAMPLE_TEXT = """
 <b>📊 ПРИМЕР РАСЧЕТА ДНЕВНОГО ЛИМИТА</b>
 
 <b>💳 Доходы:</b>
@@ -224,172 +368,283 @@ async def show_example(message: Message):
 <b>✅ Итог:</b> Чтобы накопить на отпуск за 10 месяцев, можно тратить <b>1 300 ₽ в день</b> на еду, развлечения и прочие нужды.
 
 <b>💎 Каждый день, укладываясь в этот лимит, вы гарантированно достигаете своей цели!</b>
+""".strip()
+
+# Шаблон итогового отчета, заполняется через format_map
+REPORT_TEMPLATE = """
+<b>📊 ВАШ ПЕРСОНАЛЬНЫЙ ФИНАНСОВЫЙ ОТЧЕТ</b>
+
+<b>💳 ДОХОДЫ:</b>
+├ Зарплата: {salary}
+└ Дополнительный доход: {other_income}
+<b>Итого доход: {total_income}</b>
+
+<b>🏠 РАСХОДЫ:</b>
+├ Аренда жилья: {rent}
+├ Транспорт: {transport}
+└ Прочие платежи: {other_bills}
+<b>Итого расходы: {fixed_expenses}</b>
+
+<b>🎯 ЦЕЛЬ:</b>
+├ На что копим: {goal_name}
+├ Сумма цели: {goal_amount}
+└ Срок накопления: {goal_months} месяцев
+<b>Ежемесячный взнос: {contribution}</b>
+
+<b>🧮 РАСЧЕТ:</b>
+├ Доходы: {total_income}
+├ Расходы: {fixed_expenses}
+├ Взнос на цель: {contribution}
+└ <b>Бюджет на траты: {monthly_budget}</b>
+
+<b>📅 ДНЕВНОЙ ЛИМИТ:</b>
+{monthly_budget} ÷ 30 дней = <b>{daily_limit} в день</b>
+
+<b>✅ ИТОГ:</b> Чтобы накопить на {goal_name_lower} за {goal_months} месяцев, вы можете тратить <b>{daily_limit} в день</b> на еду, развлечения и прочие нужды.
+
+<b>💎 Каждый день, укладываясь в этот лимит, вы гарантированно достигаете своей цели!</b>
+
+Чтобы начать новый расчет, нажмите «💰 Рассчитать бюджет»
+""".strip()
+
+# ================== КЭШ СТАТИЧНЫХ СООБЩЕНИЙ ==================
+# message_id статичных сообщений в CACHE_CHAT_ID
+cached_message_ids: Dict[str, int] = {}
+
+async def cache_static_messages():
+    """Запоминает message_id статичных текстов в служебном чате, при необходимости отправляя их"""
+    for key, text in (("welcome", WELCOME_TEXT), ("example", EXAMPLE_TEXT)):
+        env_name = f"CACHE_{key.upper()}_MSG_ID"
+        if os.getenv(env_name):
+            cached_message_ids[key] = int(os.getenv(env_name))
+            continue
+        try:
+            sent = await bot.send_message(CACHE_CHAT_ID, text, disable_notification=True)
+        except TelegramAPIError as e:
+            logger.warning(f"Не удалось закэшировать сообщения в чате {CACHE_CHAT_ID}: {e}")
+            return
+        cached_message_ids[key] = sent.message_id
+        # Без переменной окружения каждый запуск (и каждая реплика) публикует новое сообщение
+        logger.info(
+            f"📌 Сообщение '{key}' отправлено в чат {CACHE_CHAT_ID}. "
+            f"Задайте {env_name}={sent.message_id}, чтобы не отправлять его при каждом запуске"
+        )
+
+async def send_static(message: Message, key: str, text: str):
+    """Отправляет статичное сообщение: копией из кэша, если она есть, иначе текстом"""
+    message_id = cached_message_ids.get(key)
+    if message_id is None:
+        await message.answer(text, reply_markup=MAIN_KB)
+        return
+    try:
+        await bot.copy_message(
+            chat_id=message.chat.id,
+            from_chat_id=CACHE_CHAT_ID,
+            message_id=message_id,
+            reply_markup=MAIN_KB
+        )
+    except (TelegramBadRequest, TelegramForbiddenError) as e:
+        # Сообщение удалено или доступ к чату потерян — дальше отправляем текстом
+        logger.warning(f"Не удалось скопировать сообщение '{key}' из чата {CACHE_CHAT_ID}: {e}")
+        cached_message_ids.pop(key, None)
+        await message.answer(text, reply_markup=MAIN_KB)
+    except TelegramAPIError as e:
+        # Временная ошибка (сеть, лимит запросов) — текстом только в этот раз, кэш не трогаем
+        logger.warning(f"Временная ошибка при копировании сообщения '{key}': {e}")
+        await message.answer(text, reply_markup=MAIN_KB)
+
+# ================== ОБРАБОТЧИКИ КОМАНД ==================
+@dp.message(Command("start", "help"))
+async def cmd_start(message: Message):
+    """
+    Обработчик команд /start и /help
     """
-    await message.answer(example_text, reply_markup=get_main_keyboard())
+    await send_static(message, "welcome", WELCOME_TEXT)
+
+async def cmd_help(message: Message, state: FSMContext):
+    """Показать справку"""
+    await cmd_start(message)
+
+async def show_example(message: Message, state: FSMContext):
+    """Показать пример расчета"""
+    await send_static(message, "example", EXAMPLE_TEXT)
 
 # ================== НАЧАЛО РАСЧЕТА ==================
-@dp.message(F.text == "💰 Рассчитать бюджет")
 async def start_calculation(message: Message, state: FSMContext):
     """
     Начало процесса расчета бюджета
     """
     # Сброс предыдущих данных
-    user_data[message.from_user.id] = {}
+    await state.set_data({})
     
     # Начало диалога
     await message.answer(
         "🎯 <b>Отлично! Давайте рассчитаем ваш персональный бюджет.</b>\n\n"
         "<b>Введите вашу зарплату (основной доход):</b>\n"
         "<i>Просто отправьте число, например: 70000</i>",
-        reply_markup=get_cancel_keyboard()
+        reply_markup=CANCEL_KB
     )
     await state.set_state(BudgetStates.waiting_for_salary)
 
+# ================== КНОПКИ ГЛАВНОГО МЕНЮ ==================
+# Один обработчик на все кнопки меню вместо отдельного фильтра на каждую
+TEXT_HANDLERS = {
+    "❓ Помощь": cmd_help,
+    "📊 Пример расчета": show_example,
+    "💰 Рассчитать бюджет": start_calculation,
+}
+
+@dp.message(F.text.in_(TEXT_HANDLERS.keys()))
+async def menu_router(message: Message, state: FSMContext):
+    """Передает нажатие кнопки меню соответствующему обработчику"""
+    await TEXT_HANDLERS[message.text](message, state)
+
 # ================== ОБРАБОТЧИКИ ВВОДА ДАННЫХ ==================
-@dp.message(BudgetStates.waiting_for_salary)
-async def process_salary(message: Message, state: FSMContext):
-    """Обработка ввода зарплаты"""
-    if message.text == "❌ Отменить расчет":
-        await cancel_calculation(message, state)
-        return
-    
-    try:
-        salary = int(message.text.replace(" ", "").replace(",", ""))
-        if salary <= 0:
-            raise ValueError
-        
-        # Сохраняем данные
-        user_data[message.from_user.id]['salary'] = salary
-        
-        await message.answer(
-            f"✅ <b>Зарплата:</b> {format_rubles(salary)}\n\n"
-            "<b>Введите другие источники дохода в месяц:</b>\n"
-            "<i>Если нет других доходов, отправьте 0 или нажмите 'Пропустить'</i>",
-            reply_markup=get_skip_keyboard()
-        )
-        await state.set_state(BudgetStates.waiting_for_other_income)
-        
-    except ValueError:
-        await message.answer(
+class Step(NamedTuple):
+    """Описание шага ввода числового значения"""
+    field: str                                      # ключ в данных состояния
+    allow_zero: bool                                # допускается ли 0
+    error: str                                      # сообщение о некорректном вводе
+    next_state: Optional[State] = None              # None — последний шаг, выводим отчет
+    keyboard: Optional[ReplyKeyboardMarkup] = None  # клавиатура следующего шага
+    prefix: str = ""                                # начало подтверждения (до суммы)
+    suffix: str = ""                                # конец подтверждения: вопрос следующего шага
+
+CANCEL_BUTTONS = frozenset({"❌ Отменить расчет", "❌ Отменить"})
+SKIP_BUTTON = "⏭ Пропустить"
+
+# Числовые шаги диалога: состояние -> что сохранить, что спросить дальше
+STEPS: Dict[str, Step] = {
+    BudgetStates.waiting_for_salary.state: Step(
+        field="salary",
+        allow_zero=False,
+        error=(
             "⚠️ <b>Пожалуйста, введите корректное число</b>\n"
             "<i>Пример: 70000 или 85 000</i>"
-        )
-
-@dp.message(BudgetStates.waiting_for_other_income)
-async def process_other_income(message: Message, state: FSMContext):
-    """Обработка дополнительных доходов"""
-    if message.text == "❌ Отменить":
+        ),
+        next_state=BudgetStates.waiting_for_other_income,
+        keyboard=SKIP_KB,
+        prefix="✅ <b>Зарплата:</b> ",
+        suffix=(
+            "\n\n<b>Введите другие источники дохода в месяц:</b>\n"
+            "<i>Если нет других доходов, отправьте 0 или нажмите 'Пропустить'</i>"
+        ),
+    ),
+    BudgetStates.waiting_for_other_income.state: Step(
+        field="other_income",
+        allow_zero=True,
+        error=(
+            "⚠️ <b>Пожалуйста, введите корректное число</b>\n"
+            "<i>Пример: 10000 или 0</i>"
+        ),
+        next_state=BudgetStates.waiting_for_rent,
+        keyboard=CANCEL_KB,
+        prefix="✅ <b>Дополнительный доход:</b> ",
+        suffix=(
+            "\n\n<b>Введите стоимость аренды жилья (или ипотека):</b>\n"
+            "<i>Если нет, отправьте 0</i>"
+        ),
+    ),
+    BudgetStates.waiting_for_rent.state: Step(
+        field="rent",
+        allow_zero=True,
+        error=(
+            "⚠️ <b>Пожалуйста, введите корректное число</b>\n"
+            "<i>Пример: 30000 или 0</i>"
+        ),
+        next_state=BudgetStates.waiting_for_transport,
+        keyboard=CANCEL_KB,
+        prefix="✅ <b>Аренда:</b> ",
+        suffix=(
+            "\n\n<b>Введите расходы на транспорт в месяц:</b>\n"
+            "<i>Такси, метро, бензин и т.д. Если нет, отправьте 0</i>"
+        ),
+    ),
+    BudgetStates.waiting_for_transport.state: Step(
+        field="transport",
+        allow_zero=True,
+        error=(
+            "⚠️ <b>Пожалуйста, введите корректное число</b>\n"
+            "<i>Пример: 5000 или 0</i>"
+        ),
+        next_state=BudgetStates.waiting_for_other_bills,
+        keyboard=CANCEL_KB,
+        prefix="✅ <b>Транспорт:</b> ",
+        suffix=(
+            "\n\n<b>Введите другие обязательные платежи в месяц:</b>\n"
+            "<i>Связь, интернет, коммунальные услуги и т.д. Если нет, отправьте 0</i>"
+        ),
+    ),
+    BudgetStates.waiting_for_other_bills.state: Step(
+        field="other_bills",
+        allow_zero=True,
+        error=(
+            "⚠️ <b>Пожалуйста, введите корректное число</b>\n"
+            "<i>Пример: 5000 или 0</i>"
+        ),
+        next_state=BudgetStates.waiting_for_goal_name,
+        keyboard=CANCEL_KB,
+        prefix="✅ <b>Прочие платежи:</b> ",
+        suffix=(
+            "\n\n<b>Теперь установим финансовую цель!</b>\n\n"
+            "<b>На что вы хотите накопить?</b>\n"
+            "<i>Пример: 'Отпуск на море', 'Новый ноутбук', 'Автомобиль'</i>"
+        ),
+    ),
+    BudgetStates.waiting_for_goal_amount.state: Step(
+        field="goal_amount",
+        allow_zero=False,
+        error=(
+            "⚠️ <b>Пожалуйста, введите корректное число</b>\n"
+            "<i>Пример: 150000</i>"
+        ),
+        next_state=BudgetStates.waiting_for_goal_months,
+        keyboard=CANCEL_KB,
+        prefix="✅ <b>Сумма цели:</b> ",
+        suffix=(
+            "\n\n<b>За сколько месяцев вы хотите накопить эту сумму?</b>\n"
+            "<i>Пример: 12 (год), 24 (2 года), 6 (полгода)</i>"
+        ),
+    ),
+    BudgetStates.waiting_for_goal_months.state: Step(
+        field="goal_months",
+        allow_zero=False,
+        error=(
+            "⚠️ <b>Пожалуйста, введите корректное число месяцев</b>\n"
+            "<i>Пример: 12 (год), 24 (2 года)</i>"
+        ),
+    ),
+}
+
+@dp.message(StateFilter(*STEPS))
+async def process_number(message: Message, state: FSMContext, raw_state: str):
+    """Обработка ввода числового значения на любом шаге из STEPS"""
+    if message.text in CANCEL_BUTTONS:
         await cancel_calculation(message, state)
         return
-    elif message.text == "⏭ Пропустить":
-        other_income = 0
-    else:
-        try:
-            other_income = int(message.text.replace(" ", "").replace(",", ""))
-            if other_income < 0:
-                raise ValueError
-        except ValueError:
-            await message.answer(
-                "⚠️ <b>Пожалуйста, введите корректное число</b>\n"
-                "<i>Пример: 10000 или 0</i>"
-            )
-            return
     
-    # Сохраняем данные
-    user_data[message.from_user.id]['other_income'] = other_income
+    step = STEPS[raw_state]
     
-    await message.answer(
-        f"✅ <b>Дополнительный доход:</b> {format_rubles(other_income)}\n\n"
-        "<b>Введите стоимость аренды жилья (или ипотека):</b>\n"
-        "<i>Если нет, отправьте 0</i>",
-        reply_markup=get_cancel_keyboard()
-    )
-    await state.set_state(BudgetStates.waiting_for_rent)
-
-@dp.message(BudgetStates.waiting_for_rent)
-async def process_rent(message: Message, state: FSMContext):
-    """Обработка ввода аренды"""
-    if message.text == "❌ Отменить расчет":
-        await cancel_calculation(message, state)
-        return
+    if message.text == SKIP_BUTTON and step.allow_zero:
+        value = 0
+    else:
+        value = parse_int(message.text or "")
+        if value is None or (value == 0 and not step.allow_zero):
+            await message.answer(step.error)
+            return
     
-    try:
-        rent = int(message.text.replace(" ", "").replace(",", ""))
-        if rent < 0:
-            raise ValueError
-        
-        user_data[message.from_user.id]['rent'] = rent
-        
-        await message.answer(
-            f"✅ <b>Аренда:</b> {format_rubles(rent)}\n\n"
-            "<b>Введите расходы на транспорт в месяц:</b>\n"
-            "<i>Такси, метро, бензин и т.д. Если нет, отправьте 0</i>",
-            reply_markup=get_cancel_keyboard()
-        )
-        await state.set_state(BudgetStates.waiting_for_transport)
-        
-    except ValueError:
-        await message.answer(
-            "⚠️ <b>Пожалуйста, введите корректное число</b>\n"
-            "<i>Пример: 30000 или 0</i>"
-        )
-
-@dp.message(BudgetStates.waiting_for_transport)
-async def process_transport(message: Message, state: FSMContext):
-    """Обработка ввода транспортных расходов"""
-    if message.text == "❌ Отменить расчет":
-        await cancel_calculation(message, state)
-        return
+    # Сохраняем значение и получаем все данные расчета
+    data = await state.update_data({step.field: value})
     
-    try:
-        transport = int(message.text.replace(" ", "").replace(",", ""))
-        if transport < 0:
-            raise ValueError
-        
-        user_data[message.from_user.id]['transport'] = transport
-        
-        await message.answer(
-            f"✅ <b>Транспорт:</b> {format_rubles(transport)}\n\n"
-            "<b>Введите другие обязательные платежи в месяц:</b>\n"
-            "<i>Связь, интернет, коммунальные услуги и т.д. Если нет, отправьте 0</i>",
-            reply_markup=get_cancel_keyboard()
-        )
-        await state.set_state(BudgetStates.waiting_for_other_bills)
-        
-    except ValueError:
-        await message.answer(
-            "⚠️ <b>Пожалуйста, введите корректное число</b>\n"
-            "<i>Пример: 5000 или 0</i>"
-        )
-
-@dp.message(BudgetStates.waiting_for_other_bills)
-async def process_other_bills(message: Message, state: FSMContext):
-    """Обработка ввода прочих платежей"""
-    if message.text == "❌ Отменить расчет":
-        await cancel_calculation(message, state)
+    if step.next_state is None:
+        await send_report(message, state, data)
         return
     
-    try:
-        other_bills = int(message.text.replace(" ", "").replace(",", ""))
-        if other_bills < 0:
-            raise ValueError
-        
-        user_data[message.from_user.id]['other_bills'] = other_bills
-        
-        await message.answer(
-            f"✅ <b>Прочие платежи:</b> {format_rubles(other_bills)}\n\n"
-            "<b>Теперь установим финансовую цель!</b>\n\n"
-            "<b>На что вы хотите накопить?</b>\n"
-            "<i>Пример: 'Отпуск на море', 'Новый ноутбук', 'Автомобиль'</i>",
-            reply_markup=get_cancel_keyboard()
-        )
-        await state.set_state(BudgetStates.waiting_for_goal_name)
-        
-    except ValueError:
-        await message.answer(
-            "⚠️ <b>Пожалуйста, введите корректное число</b>\n"
-            "<i>Пример: 5000 или 0</i>"
-        )
+    await message.answer(
+        step.prefix + format_rubles(value) + step.suffix,
+        reply_markup=step.keyboard
+    )
+    await state.set_state(step.next_state)
 
 @dp.message(BudgetStates.waiting_for_goal_name)
 async def process_goal_name(message: Message, state: FSMContext):
@@ -399,114 +654,48 @@ async def process_goal_name(message: Message, state: FSMContext):
         return
     
     goal_name = message.text
-    user_data[message.from_user.id]['goal_name'] = goal_name
+    await state.update_data(goal_name=goal_name)
     
     await message.answer(
         f"✅ <b>Цель:</b> {goal_name}\n\n"
         f"<b>Какую сумму хотите накопить на {goal_name.lower()}?</b>\n"
         "<i>Пример: 150000</i>",
-        reply_markup=get_cancel_keyboard()
+        reply_markup=CANCEL_KB
     )
     await state.set_state(BudgetStates.waiting_for_goal_amount)
 
-@dp.message(BudgetStates.waiting_for_goal_amount)
-async def process_goal_amount(message: Message, state: FSMContext):
-    """Обработка суммы цели"""
-    if message.text == "❌ Отменить расчет":
-        await cancel_calculation(message, state)
-        return
+async def send_report(message: Message, state: FSMContext, data: Dict):
+    """Расчет и вывод итогового отчета"""
+    budget = Budget(**data)
     
-    try:
-        goal_amount = int(message.text.replace(" ", "").replace(",", ""))
-        if goal_amount <= 0:
-            raise ValueError
-        
-        user_data[message.from_user.id]['goal_amount'] = goal_amount
-        
-        await message.answer(
-            f"✅ <b>Сумма цели:</b> {format_rubles(goal_amount)}\n\n"
-            "<b>За сколько месяцев вы хотите накопить эту сумму?</b>\n"
-            "<i>Пример: 12 (год), 24 (2 года), 6 (полгода)</i>",
-            reply_markup=get_cancel_keyboard()
-        )
-        await state.set_state(BudgetStates.waiting_for_goal_months)
-        
-    except ValueError:
-        await message.answer(
-            "⚠️ <b>Пожалуйста, введите корректное число</b>\n"
-            "<i>Пример: 150000</i>"
-        )
-
-@dp.message(BudgetStates.waiting_for_goal_months)
-async def process_goal_months(message: Message, state: FSMContext):
-    """Обработка срока цели и вывод результата"""
-    if message.text == "❌ Отменить расчет":
-        await cancel_calculation(message, state)
-        return
+    # Выполняем расчет
+    results = calculate_results(budget)
     
-    try:
-        goal_months = int(message.text.replace(" ", "").replace(",", ""))
-        if goal_months <= 0:
-            raise ValueError
-        
-        user_data[message.from_user.id]['goal_months'] = goal_months
-        
-        # Получаем все данные
-        data = user_data[message.from_user.id]
-        
-        # Выполняем расчет
-        results = calculate_results(data)
-        
-        # Формируем отчет
-        report = f"""
-<b>📊 ВАШ ПЕРСОНАЛЬНЫЙ ФИНАНСОВЫЙ ОТЧЕТ</b>
-
-<b>💳 ДОХОДЫ:</b>
-├ Зарплата: {format_rubles(data['salary'])}
-└ Дополнительный доход: {format_rubles(data.get('other_income', 0))}
-<b>Итого доход: {format_rubles(results['total_income'])}</b>
-
-<b>🏠 РАСХОДЫ:</b>
-├ Аренда жилья: {format_rubles(data.get('rent', 0))}
-├ Транспорт: {format_rubles(data.get('transport', 0))}
-└ Прочие платежи: {format_rubles(data.get('other_bills', 0))}
-<b>Итого расходы: {format_rubles(results['fixed_expenses'])}</b>
-
-<b>🎯 ЦЕЛЬ:</b>
-├ На что копим: {data['goal_name']}
-├ Сумма цели: {format_rubles(data['goal_amount'])}
-└ Срок накопления: {goal_months} месяцев
-<b>Ежемесячный взнос: {format_rubles(results['monthly_contribution'])}</b>
-
-<b>🧮 РАСЧЕТ:</b>
-├ Доходы: {format_rubles(results['total_income'])}
-├ Расходы: {format_rubles(results['fixed_expenses'])}
-├ Взнос на цель: {format_rubles(results['monthly_contribution'])}
-└ <b>Бюджет на траты: {format_rubles(results['monthly_budget'])}</b>
-
-<b>📅 ДНЕВНОЙ ЛИМИТ:</b>
-{format_rubles(results['monthly_budget'])} ÷ 30 дней = <b>{format_rubles(results['daily_limit'])} в день</b>
-
-<b>✅ ИТОГ:</b> Чтобы накопить на {data['goal_name'].lower()} за {goal_months} месяцев, вы можете тратить <b>{format_rubles(results['daily_limit'])} в день</b> на еду, развлечения и прочие нужды.
-
-<b>💎 Каждый день, укладываясь в этот лимит, вы гарантированно достигаете своей цели!</b>
-
-Чтобы начать новый расчет, нажмите «💰 Рассчитать бюджет»
-        """
-        
-        await message.answer(report, reply_markup=get_main_keyboard())
-        
-        # Очищаем состояние
-        await state.clear()
-        
-        # Логируем успешный расчет
-        logger.info(f"✅ User {message.from_user.id} completed calculation. Daily limit: {results['daily_limit']} ₽")
-        
-    except ValueError:
-        await message.answer(
-            "⚠️ <b>Пожалуйста, введите корректное число месяцев</b>\n"
-            "<i>Пример: 12 (год), 24 (2 года)</i>"
-        )
+    # Каждая сумма форматируется один раз, даже если встречается в отчете дважды
+    report = REPORT_TEMPLATE.format_map({
+        'salary': format_rubles(budget.salary),
+        'other_income': format_rubles(budget.other_income),
+        'rent': format_rubles(budget.rent),
+        'transport': format_rubles(budget.transport),
+        'other_bills': format_rubles(budget.other_bills),
+        'goal_name': budget.goal_name,
+        'goal_name_lower': budget.goal_name.lower(),
+        'goal_amount': format_rubles(budget.goal_amount),
+        'goal_months': budget.goal_months,
+        'total_income': format_rubles(results.total_income),
+        'fixed_expenses': format_rubles(results.fixed_expenses),
+        'contribution': format_rubles(results.monthly_contribution),
+        'monthly_budget': format_rubles(results.monthly_budget),
+        'daily_limit': format_rubles(results.daily_limit),
+    })
+    
+    await message.answer(report, reply_markup=MAIN_KB)
+    
+    # Очищаем состояние
+    await state.clear()
+    
+    # Логируем успешный расчет
+    logger.info(f"✅ User {message.from_user.id} completed calculation. Daily limit: {results.daily_limit} ₽")
 
 async def cancel_calculation(message: Message, state: FSMContext):
     """Отмена текущего расчета"""
@@ -514,7 +703,7 @@ async def cancel_calculation(message: Message, state: FSMContext):
     await message.answer(
         "❌ <b>Расчет отменен.</b>\n\n"
         "Чтобы начать заново, нажмите «💰 Рассчитать бюджет»",
-        reply_markup=get_main_keyboard()
+        reply_markup=MAIN_KB
     )
 
 # ================== ЗАПУСК БОТА ==================
@@ -526,23 +715,40 @@ async def main():
     logger.info("=" * 50)
     
     try:
-        # Запускаем веб-сервер для health checks
+        # Запускаем веб-сервер для health checks и параллельно настраиваем вебхук
         logger.info("🌐 Запуск health check сервера на порту 8080...")
-        web_task = asyncio.create_task(start_web_server())
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(start_web_server())
+            if CACHE_CHAT_ID:
+                tg.create_task(cache_static_messages())
+            if WEBHOOK_URL:
+                tg.create_task(bot.set_webhook(
+                    f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+                    drop_pending_updates=True,
+                    secret_token=WEBHOOK_SECRET,
+                ))
+            else:
+                # Удаляем вебхук если есть (для чистого запуска)
+                tg.create_task(bot.delete_webhook(drop_pending_updates=True))
         
-        # Даем время веб-серверу запуститься
-        await asyncio.sleep(1)
-        
-        # Удаляем вебхук если есть (для чистого запуска)
-        await bot.delete_webhook(drop_pending_updates=True)
-        
-        # Запускаем бота
-        logger.info("🤖 Запуск Telegram бота...")
-        await dp.start_polling(bot)
+        if WEBHOOK_URL:
+            # Держим веб-сервер запущенным
+            logger.info(f"🤖 Telegram бот работает через вебхук: {WEBHOOK_URL}/webhook/...")
+            await asyncio.Event().wait()
+        else:
+            # Запускаем бота
+            logger.info("🤖 Запуск Telegram бота...")
+            await dp.start_polling(bot)
         
     except Exception as e:
         logger.error(f"Критическая ошибка при запуске бота: {e}")
         raise
 
 if __name__ == '__main__':
+    # uvloop — более быстрый цикл событий на libuv (на Windows недоступен)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
     asyncio.run(main())